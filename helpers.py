@@ -1,61 +1,105 @@
 #! /usr/env/bin python3
+import os
+import codecs
+import ctypes
+import contextlib
 import hashlib
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+from pathlib import Path
 
 def seedFrontTrashlength(arguments):
-	sum1 = 0
-	for letter in arguments['key']:
-		sum1 += ord(letter)
-
-	sum2 = 0
-	for letter in arguments['fileName']:
-		sum2 += ord(letter)
+	sum1 = sum(map(ord, arguments['key']))
+	sum2 = sum(map(ord, arguments['fileName']))
 
 	return (sum1 ^ sum2)
 
 
 def createIV(arguments):
-	hashable1 = arguments['hash'] + arguments['fileName']
-	return hashlib.sha256(hashable1.encode('utf-8')).hexdigest()[0:16]
+	# feed both parts straight into the hash rather than joining them into a temporary string first
+	hashable = hashlib.sha256(arguments['hash'].encode('utf-8'))
+	hashable.update(arguments['fileName'].encode('utf-8'))
+	return hashable.hexdigest()[0:16].encode('utf-8')
 
 def seedBackTrashlength(arguments):
-	sum1 = 0
-	for letter in arguments['hash']:
-		sum1 -= ord(letter)
-
-	sum2 = 0
-	for letter in arguments['fileName']:
-		sum2 += ord(letter)
+	sum1 = -sum(map(ord, arguments['hash']))
+	sum2 = sum(map(ord, arguments['fileName']))
 
 	return abs(~(sum1 & sum2))
 
+CONFIG_FILE = Path('files/config.ini')
+
+# hands back the path rather than an open file so the caller can open it in a with block and it always gets closed
 def findConfigFile():
-	file = None
+	if CONFIG_FILE.is_file():
+		return CONFIG_FILE
+	return None
+
+# overwrites a bytearray in place with zeros, through ctypes so it can't be skipped the way an assignment can
+def secureWipe(buffer):
+	if buffer:
+		ctypes.memset((ctypes.c_char * len(buffer)).from_buffer(buffer), 0, len(buffer))
+
+# writes to a temporary file beside path, flushes it to disk and only then renames it over path,
+# so a crash part way through leaves either the old file or the new one, never half of one
+def atomicWriteFile(path, data):
+	temporaryPath = path + '.tmp.' + str(os.getpid())
+	fileDescriptor = os.open(temporaryPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o600)
 	try:
-		file = open('files/config.ini','r' )
-	except Exception as e:
-		pass
-	return file 
+		try:
+			remaining = memoryview(data)
+			while remaining:
+				remaining = remaining[os.write(fileDescriptor, remaining):]
+			os.fsync(fileDescriptor)
+		finally:
+			os.close(fileDescriptor)
+		os.replace(temporaryPath, path)
+	except BaseException:
+		# don't leave the temporary file for push.sh to commit, and don't let cleaning up hide the real error
+		with contextlib.suppress(FileNotFoundError):
+			os.remove(temporaryPath)
+		raise
+
+	# the rename only survives a crash once the directory entry itself is on disk (windows can't open directories);
+	# some mounts (network shares, wsl1 drvfs) refuse to fsync a directory, and by now the file is written anyway
+	if os.name == 'posix':
+		try:
+			directoryDescriptor = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+			try:
+				os.fsync(directoryDescriptor)
+			finally:
+				os.close(directoryDescriptor)
+		except OSError:
+			pass
+
+def createCipher(arguments):
+	# cryptography is only needed once something is actually encrypted or decrypted,
+	# so runs that only pad or print the password don't pay for loading it
+	from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+	iv = createIV(arguments)
+	return Cipher(algorithms.AES(arguments['hash'].encode('utf-8')), modes.CBC(iv))
 
 def decryptString(arguments, string):
 	offset = len(string)%16
 	string = string[0:(len(string)-offset)]
-	backend = default_backend()
-	key = arguments['hash']
-	iv = createIV(arguments)
-	cipher = Cipher(algorithms.AES(key.encode('utf-8')), modes.CBC(iv.encode('utf-8')), backend=backend)
+	cipher = createCipher(arguments)
 	decryptor = cipher.decryptor()
-	plaintext = decryptor.update(string) + decryptor.finalize()
-	return str(plaintext, 'utf-8')
+	# decrypt into a buffer we own so the plaintext bytes can be wiped instead of left for the garbage collector
+	plaintext = bytearray(len(string) + 15)
+	try:
+		length = decryptor.update_into(string, plaintext)
+		decryptor.finalize()
+		# encryptString trims on bytes, which can split a multi-byte character at the very end of the trailing trash;
+		# drop only that unfinished tail, so bad bytes anywhere else (a wrong key) still raise UnicodeDecodeError
+		return codecs.getincrementaldecoder('utf-8')().decode(memoryview(plaintext)[:length], final=False)
+	finally:
+		secureWipe(plaintext)
 
 def encryptString(arguments, string):
-	offset = len(string)%16
-	string = string[0:(len(string)-offset)]
-	backend = default_backend()
-	key = arguments['hash']
-	iv = createIV(arguments)
-	cipher = Cipher(algorithms.AES(key.encode('utf-8')), modes.CBC(iv.encode('utf-8')), backend=backend)
+	# the block size is in bytes, so trim after encoding or multi-byte characters throw the count off
+	plaintext = string.encode('utf-8')
+	offset = len(plaintext)%16
+	plaintext = plaintext[0:(len(plaintext)-offset)]
+	cipher = createCipher(arguments)
 	encryptor = cipher.encryptor()
-	ct = encryptor.update(string.encode('utf-8')) + encryptor.finalize()
+	ct = encryptor.update(plaintext) + encryptor.finalize()
 	return ct
\ No newline at end of file
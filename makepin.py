@@ -5,6 +5,8 @@ import platform
 import random
 import time
 import struct
+import secrets
+import functools
 
 try:
     import pyperclip
@@ -14,67 +16,154 @@ from words import *
 from helpers import *
 
 
+class RandomPool:
+    # hands out uniform integers from a block of os entropy, refilled only when it runs dry
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+        self.block = b''
+        self.offset = 0
+
+    def randbelow(self, upper_bound):
+        # character alphabets fit in a byte, so read those straight out of the block and skip struct entirely;
+        # values past the last whole multiple of upper_bound are thrown away so the modulo stays unbiased
+        if upper_bound <= 0:
+            raise ValueError(f'no integers below {upper_bound} to pick from')
+        if upper_bound <= 1 << 8:
+            limit = 256 - 256 % upper_bound
+            while True:
+                if self.offset >= len(self.block):
+                    self.block = secrets.token_bytes(self.block_size)
+                    self.offset = 0
+                value = self.block[self.offset]
+                self.offset += 1
+                if value < limit:
+                    return value % upper_bound
+
+        if upper_bound <= 1 << 16:
+            chunk_format, chunk_size, chunk_range = '<H', 2, 1 << 16
+        else:
+            chunk_format, chunk_size, chunk_range = '<I', 4, 1 << 32
+        limit = chunk_range - chunk_range % upper_bound
+        while True:
+            if self.offset + chunk_size > len(self.block):
+                self.block = secrets.token_bytes(self.block_size)
+                self.offset = 0
+            value = struct.unpack_from(chunk_format, self.block, self.offset)[0]
+            self.offset += chunk_size
+            if value < limit:
+                return value % upper_bound
+
+    def characters(self, alphabet, count):
+        # pull the entropy for a whole run of characters at once instead of going through randbelow per character
+        number_of_characters = len(alphabet)
+        if number_of_characters > 1 << 8:
+            return ''.join([alphabet[self.randbelow(number_of_characters)] for i in range(count)])
+
+        limit = 256 - 256 % number_of_characters
+        picked = []
+        while len(picked) < count:
+            missing = count - len(picked)
+            # ask for a little extra so the bytes lost to rejection rarely need a second round
+            picked += [alphabet[value % number_of_characters]
+                       for value in secrets.token_bytes(missing + missing // 2 + 8) if value < limit]
+        return ''.join(picked[:count])
+
+
+random_pool = RandomPool()
+
+
+DIGITS = '1234567890'
+ALPHAS = 'QWERTYUIOPLKJHGFDSAZXCVBNMqwertyuiopasdfghjklzxcvbnm'
+ALPHANUMERICS = '1234567890qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM'
+DEFAULT_SYMBOLS = ',./;\\[]!@#$%^&*()_+?|:+-=<>:|{}_'
+
+
+# the symbol set stays the same for a whole run, so build each alphabet once instead of once per character
+@functools.lru_cache(maxsize=32)
+def symbol_alphabet(optional_symbols):
+    return DIGITS + optional_symbols
+
+
+@functools.lru_cache(maxsize=32)
+def character_alphabet(optional_symbols):
+    return ALPHANUMERICS + optional_symbols
+
+
 def replace_with_symbol(optional_symbols):
-    symbols_to_sample_from = '1234567890' + optional_symbols
-    return symbols_to_sample_from[random.randint(0, len(symbols_to_sample_from) - 1)]
+    symbols_to_sample_from = symbol_alphabet(optional_symbols)
+    return symbols_to_sample_from[random_pool.randbelow(len(symbols_to_sample_from))]
 
 
 def replace_with_alpha():
-    alphas_to_sample_from = 'QWERTYUIOPLKJHGFDSAZXCVBNMqwertyuiopasdfghjklzxcvbnm'
-    return alphas_to_sample_from[random.randint(0, len(alphas_to_sample_from) - 1)]
+    return ALPHAS[random_pool.randbelow(len(ALPHAS))]
 
 
 def add_character(optional_symbols):
-    characters_to_sample_from = '1234567890qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM' + optional_symbols
-    return characters_to_sample_from[random.randint(0, len(characters_to_sample_from) - 1)]
+    characters_to_sample_from = character_alphabet(optional_symbols)
+    return characters_to_sample_from[random_pool.randbelow(len(characters_to_sample_from))]
+
+
+def add_characters(optional_symbols, count):
+    return random_pool.characters(character_alphabet(optional_symbols), count)
+
+
+# (word_list, words sorted by length, how many of those are at most n characters long for each n)
+# for the last list add_word was called with
+word_length_index = None
+
+
+def index_words_by_length(word_list):
+    global word_length_index
+    if word_length_index is None or word_length_index[0] is not word_list:
+        words_by_length = sorted(word_list, key=len)
+        longest = len(words_by_length[-1]) if words_by_length else 0
+        words_at_most_length = [0] * (longest + 1)
+        for word in words_by_length:
+            words_at_most_length[len(word)] += 1
+        for length in range(1, longest + 1):
+            words_at_most_length[length] += words_at_most_length[length - 1]
+        word_length_index = (word_list, words_by_length, words_at_most_length)
+    return word_length_index[1], word_length_index[2]
 
 
 def add_word(word_list, length):
     if length == -1:
-        return word_list[random.randint(0, len(word_list) - 1)]
+        return word_list[random_pool.randbelow(len(word_list))]
     else:
-        words_of_a_certain_length = []
+        words_by_length, words_at_most_length = index_words_by_length(word_list)
+        number_of_short_enough_words = 0
+        if length >= 0:
+            number_of_short_enough_words = words_at_most_length[min(length, len(words_at_most_length) - 1)]
+        if number_of_short_enough_words == 0:
+            raise ValueError(f'no words of length {length} or less in word list')
 
-        for word in word_list:
-            if len(word) <= length:
-                words_of_a_certain_length.append(word)
-
-        return words_of_a_certain_length[random.randint(0, len(words_of_a_certain_length) - 1)]
+        return words_by_length[random_pool.randbelow(number_of_short_enough_words)]
 
 
 def write_plaintext_file(contents, arguments):
-    with open('files/' + arguments['fileName'] + arguments['fileExtension'], 'w') as file:
-        file.write(contents)
-        arguments['length'] = str(len(contents))
-        if arguments['useClipboard'] > 0:
-            pyperclip.copy(contents)
-        if arguments['useClipboard'] == 2:
-            contents = '[CONTENTS REDACTED]'
-        print('\nnew password: ' + contents + '\nlength: ' + arguments['length'] + '\nfile: ' + 'files/' + arguments[
-            'fileName'] + '\npadding: False\nencryption: False')
+    atomicWriteFile('files/' + arguments['fileName'] + arguments['fileExtension'], contents.encode('utf-8'))
+
+    arguments['length'] = str(len(contents))
+    if arguments['useClipboard'] > 0:
+        pyperclip.copy(contents)
+    if arguments['useClipboard'] == 2:
+        contents = '[CONTENTS REDACTED]'
+    print('\nnew password: ' + contents + '\nlength: ' + arguments['length'] + '\nfile: ' + 'files/' + arguments[
+        'fileName'] + '\npadding: False\nencryption: False')
 
 
 def write_padded_file(contents, word_list, arguments):
     front = ''
     back = ''
-    write_protocol = 'w'
     front_pad_length = seedFrontTrashlength(arguments)
     back_pad_length = seedBackTrashlength(arguments)
 
-    if os.path.isfile('files/' + arguments['fileName'] + '.pad'):
-        os.remove('files/' + arguments['fileName'] + '.pad')
-    if os.path.isfile(arguments['fileName'] + '.enc'):
-        os.remove('files/' + arguments['fileName'] + '.enc')
-
     while (front_pad_length + arguments['length'] + back_pad_length) % 16 != 0:
         back_pad_length += 1
 
     if not arguments['words']:
-        for i in range(0, front_pad_length):
-            front += add_character(arguments['symbols'])
-
-        for i in range(0, back_pad_length):
-            back += add_character(arguments['symbols'])
+        front = add_characters(arguments['symbols'], front_pad_length)
+        back = add_characters(arguments['symbols'], back_pad_length)
     else:
 
         while len(front) < front_pad_length:
@@ -92,22 +181,31 @@ def write_padded_file(contents, word_list, arguments):
         back = back[0:back_pad_length]
 
     final_block_of_text = (front + contents + back)
+    # the padding above is counted in characters, but the cipher works on 16 byte blocks of utf-8 and multi-byte
+    # symbols make the text longer than that, so top the end up with single-byte characters until it lines up;
+    # otherwise encryptString would trim bytes that can reach back into the password
+    final_block_of_text += random_pool.characters(ALPHANUMERICS, -len(final_block_of_text.encode('utf-8')) % 16)
 
     is_text_encrypted = False
     if arguments['encrypt'] == 2:
-        write_protocol = 'wb'
         final_block_of_text = encryptString(arguments, final_block_of_text)
         is_text_encrypted = True
+    else:
+        final_block_of_text = final_block_of_text.encode('utf-8')
+
+    atomicWriteFile('files/' + arguments['fileName'] + arguments['fileExtension'], final_block_of_text)
+    # the rename above already replaced a file with the same extension; a padded file left over from before the
+    # password was encrypted only goes once the new one is safely in place
+    if arguments['fileExtension'] == '.enc' and os.path.isfile('files/' + arguments['fileName'] + '.pad'):
+        os.remove('files/' + arguments['fileName'] + '.pad')
 
-    with open('files/' + arguments['fileName'] + arguments['fileExtension'], write_protocol) as file:
-        file.write(final_block_of_text)
-        arguments['length'] = str(len(contents))
-        if arguments['useClipboard'] > 0:
-            pyperclip.copy(contents)
-        if arguments['useClipboard'] == 2:
-            contents = '[CONTENTS REDACTED]'
-        print('\nnew password: ' + contents + '\nlength: ' + arguments['length'] + '\nfile: ' + 'files/' + arguments[
-            'fileName'] + '\npadding: True\nencryption: ' + str(is_text_encrypted))
+    arguments['length'] = str(len(contents))
+    if arguments['useClipboard'] > 0:
+        pyperclip.copy(contents)
+    if arguments['useClipboard'] == 2:
+        contents = '[CONTENTS REDACTED]'
+    print('\nnew password: ' + contents + '\nlength: ' + arguments['length'] + '\nfile: ' + 'files/' + arguments[
+        'fileName'] + '\npadding: True\nencryption: ' + str(is_text_encrypted))
 
 
 def override_configs_with_file(file, arguments):
@@ -123,7 +221,6 @@ def override_configs_with_file(file, arguments):
             readable = True
         if "[precover]" in filtered_line.lower():
             readable = False
-    file.close()
     arguments['startingIndex'] = 2
     return arguments
 
@@ -159,7 +256,7 @@ def parse():
     arguments = dict()
     arguments['fileName'] = sys.argv[1]
     arguments['growthFactor'] = 1
-    arguments['symbols'] = ',./;\\[]!@#$%^&*()_+?|:+-=<>:|{}_'
+    arguments['symbols'] = DEFAULT_SYMBOLS
     arguments['length'] = -1
     arguments['encrypt'] = 2
     arguments['words'] = True
@@ -171,7 +268,8 @@ def parse():
     arguments['startingIndex'] = 3
 
     if config_file:
-        arguments = override_configs_with_file(config_file, arguments)
+        with config_file.open('r') as file:
+            arguments = override_configs_with_file(file, arguments)
 
     try:
         arguments['key'] = sys.argv[2]
@@ -192,7 +290,7 @@ def parse():
                 if i + 1 < len(args) and not args[i + 1].replace('-', '').isalpha():
                     arguments['symbols'] = args[i + 1]
                 else:
-                    arguments['symbols'] = ',./;\\[]!@#$%^&*()_+?|:+-=<>:|{}_'
+                    arguments['symbols'] = DEFAULT_SYMBOLS
                 arguments['encrypt'] = 2
                 arguments['fileExtension'] = '.enc'
                 arguments['length'] = 32
@@ -204,7 +302,7 @@ def parse():
                 if i + 1 < len(args) and not args[i + 1].replace('-', '').isalpha():
                     arguments['symbols'] = args[i + 1]
                 else:
-                    arguments['symbols'] = ',./;\\[]!@#$%^&*()_+?|:+-=<>:|{}_'
+                    arguments['symbols'] = DEFAULT_SYMBOLS
                 arguments['encrypt'] = 2
                 arguments['fileExtension'] = '.enc'
                 arguments['length'] = 16
@@ -219,13 +317,13 @@ def parse():
                 arguments['symbols'] = args[i + 1]
                 arguments['symbols'] = arguments['symbols'].replace('\'', '')
             elif args[i] == '-sR':
-                arguments['symbols'] = ',./;\\[]!@#$%^&*()_+?|:+-=<>:|{}_'
+                arguments['symbols'] = DEFAULT_SYMBOLS
                 taboos = args[i + 1]
                 taboos = taboos.replace('\'', '')
                 for taboo in taboos:
                     arguments['symbols'] = arguments['symbols'].replace(taboo, '')
             elif args[i] == '-sA':
-                arguments['symbols'] = ',./;\\[]!@#$%^&*()_+?|:+-=<>:|{}_'
+                arguments['symbols'] = DEFAULT_SYMBOLS
             elif args[i] == '-l':
                 arguments['length'] = int(args[i + 1])
             elif args[i] == '-p':
@@ -367,8 +465,7 @@ def main():
     else:
         pinhash = scrambleWithCharacters(pinhash, arguments)
 
-    if not os.path.exists('files'):
-        os.makedirs('files')
+    os.makedirs('files', exist_ok=True)
 
     if int(arguments['encrypt']) == 0:
         write_plaintext_file(pinhash, arguments)
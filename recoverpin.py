@@ -105,11 +105,14 @@ def parse():
 
 def pull(arguments):
     read_protocol = 'r'
+    # pmake writes padded files as utf-8 whatever the locale, so read them back the same way
+    read_encoding = 'utf-8'
     file_extension = '.pad'
     if arguments['encrypted']:
         read_protocol = 'rb'
+        read_encoding = None
         file_extension = '.enc'
-    with open('files/' + arguments['fileName'] + file_extension, read_protocol) as file:
+    with open('files/' + arguments['fileName'] + file_extension, read_protocol, encoding=read_encoding) as file:
         contents = file.read()
 
         if arguments['encrypted']:
@@ -1,12 +1,64 @@
 #! /usr/env/bin python3
 import os
+import functools
+
+# returns the lines in data and whether they are already title cased
+def splitWords(data):
+	# fold \r\n and \r into \n, the same line endings text mode translates, so the whole file can be
+	# decoded in one go and split on a single character instead of decoding line by line
+	data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+	# for plain ascii, title casing the whole buffer in one C pass gives the same words as str.title() on each
+	# line and can't change any lengths, so the title cased lines can be kept as they are
+	titled = data.isascii()
+	if titled:
+		data = data.title()
+
+	lines = data.decode('utf-8').split('\n')
+	# a trailing newline ends the last line rather than starting an empty one
+	if lines[-1] == '':
+		lines.pop()
+	return tuple(lines), titled
+
+def filterWords(lines, titled, maxwordlength):
+	# -1 keeps everything, so it gets its own path without a length check per line
+	if maxwordlength == -1:
+		if titled:
+			return lines
+		return tuple([line.title() for line in lines])
+
+	if titled:
+		return tuple([line for line in lines if len(line) <= maxwordlength])
+	return tuple([line.title() for line in lines if len(line) <= maxwordlength])
+
+# the caches below are keyed on the file's path, modification time and size so an edited word list is read again
+
+@functools.lru_cache(maxsize=8)
+def loadLines(path, modified, size):
+	# one read of the whole file; splitWords copies it anyway to fold line endings and title case it
+	with open(path, 'rb') as file:
+		data = file.read()
+
+	return splitWords(data)
+
+# every length limit is served from the one cached read of the file, only the filter (and title casing) is redone
+@functools.lru_cache(maxsize=32)
+def loadWords(path, modified, size, maxwordlength):
+	lines, titled = loadLines(path, modified, size)
+	return filterWords(lines, titled, maxwordlength)
 
 def importWords(filename, maxwordlength):
-	newwordlist = []
-	with open(filename, 'r') as file:
-		for line in file:
-			line = line.replace('\n', '')
-			if maxwordlength == -1 or len(line) <= maxwordlength:
-				newwordlist.append(line.title())
-
-	return newwordlist
\ No newline at end of file
+	# an already open file (or io.BytesIO / io.StringIO) is read as is, it has nothing stable to cache on
+	if hasattr(filename, 'read'):
+		data = filename.read()
+		if isinstance(data, str):
+			data = data.encode('utf-8')
+		return list(filterWords(*splitWords(data), maxwordlength))
+
+	status = os.stat(filename)
+	# no line is shorter than zero characters, so skip reading the file (the stat above still reports a missing one)
+	if maxwordlength < -1:
+		return []
+
+	# hand back a fresh list so callers can't change what later imports see
+	return list(loadWords(os.path.abspath(filename), status.st_mtime_ns, status.st_size, maxwordlength))
\ No newline at end of file